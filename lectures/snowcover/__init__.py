@@ -0,0 +1,20 @@
+""" Shared implementation of the utility functions used in the exercises of the EO Cubes and
+Clouds MOOC; the _3x_*_utilities modules next to the notebooks re-export these with the settings
+of their exercise and put lectures/ on sys.path so that the notebooks can import them from
+their exercise directories. The openEO and Pangeo versions of calculate_sca live in snowcover.backends"""
+
+from .lazy import LazyModule, benchmark_import
+from .validation import (confusion_counts, accumulate_confusion, accuracy_from_counts, validation_metrics,
+                         grouped_validation_metrics, bootstrap_validation_metrics)
+from .stations import (format_date, parse_station_dates, station_temporal_filter, index_station_frame,
+                       prepare_station_store, station_store_slice, save_station_store, load_station_store,
+                       station_spatial_filter, binarize_snow, binarize_snow_column, benchmark_binarize_snow,
+                       assign_site_snow)
+from .bbox import create_bounding_box, create_bounding_boxes, visualize_bbox, plan_bbox_reads
+from .stac import (STAC_URL, STAC_CACHE_DIR, ASSET_CACHE_DIR, stac_cache_key, read_stac_cache, write_stac_cache,
+                   pop_stac_timings, open_catalog, filter_items, search_items, search_items_concurrently,
+                   introspect_asset, generate_stac, build_stac_collection, export_stac_geoparquet,
+                   query_stac_geoparquet, extract_metadata_stac)
+from .raster import (window_moments, merge_moments, write_pam_statistics, RasterioReader, GdalReader,
+                     RASTER_READERS, compute_raster_stats, snow_classes_uint8, write_cog, validate_cog)
+from .filters import parse_query, combine_filters
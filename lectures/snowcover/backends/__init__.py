@@ -0,0 +1,2 @@
+""" Snow cover area computation, one module per platform: openeo (process graphs run on an openEO
+back-end) and pangeo (local dask arrays from STAC with stackstac)"""
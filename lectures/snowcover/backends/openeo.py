@@ -0,0 +1,123 @@
+""" Snow cover area from Sentinel-2 L2A with openEO"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import stac
+
+
+def calculate_sca(conn, bbox, temporal_extent, as_json=False, threshold=0.4, cloud_replacement=None):
+    # conn can be None to build the process graph offline, as_json returns the serialised graph
+    # cloud_replacement is the value of cloudy pixels, None leaves them as no data
+    # bbox can also be an openeo Parameter, see save_sca_process
+    from openeo.api.process import Parameter
+    from openeo.rest.datacube import DataCube
+    
+    if isinstance(bbox, Parameter):
+        spatial_extent = bbox
+    else:
+        spatial_extent = {'west':bbox[0],
+                          'east':bbox[2],
+                          'south':bbox[1],
+                          'north':bbox[3],
+                          'crs':4326
+                         }
+    load_collection = conn.load_collection if conn is not None else DataCube.load_collection
+    s2 = load_collection(
+        'SENTINEL2_L2A',
+        spatial_extent=spatial_extent,
+        bands=['B03', 'B11', 'SCL'],
+        temporal_extent=temporal_extent
+    )
+    
+    # compute ndsi and snowmap
+    green = s2.band("B03")
+    swir = s2.band("B11")
+    ndsi = (green - swir) / (green + swir)
+    
+    snowmap = ( ndsi > threshold ) * 1.0
+    
+    # mask out cloud using SCL
+    # reference: https://sentinels.copernicus.eu/web/sentinel/technical-guides/sentinel-2-msi/level-2a/algorithm-overview
+    scl_band = s2.band("SCL")
+    cloud_mask = ( (scl_band == 8) | (scl_band == 9) | (scl_band == 3) ) * 1.0
+    snowmap_cloudfree = snowmap.mask(cloud_mask, replacement=cloud_replacement)
+    
+    if as_json or conn is None:
+        return snowmap_cloudfree.to_json()
+    return snowmap_cloudfree
+
+def save_sca_process(conn, process_id="snow_cover", **sca_options):
+    # store calculate_sca as a user-defined process with bbox and temporal_extent as parameters,
+    # sca_options (threshold, cloud_replacement) are fixed in the stored process graph
+    from openeo.api.process import Parameter
+    
+    bbox = Parameter(
+        name="bbox",
+        description="Spatial extent as west, south, east, north and crs",
+        schema={"type": "object", "subtype": "bounding-box"})
+    temporal_extent = Parameter(
+        name="temporal_extent",
+        description="Start and end date",
+        schema={"type": "array", "subtype": "temporal-interval"})
+    snowmap_cloudfree = calculate_sca(conn, bbox, temporal_extent, **sca_options)
+    conn.save_user_defined_process(
+        user_defined_process_id=process_id,
+        process_graph=snowmap_cloudfree,
+        parameters=[bbox, temporal_extent])
+    return process_id
+
+def run_sca_jobs(conn,
+                 jobs,
+                 out_dir,
+                 process_id="snow_cover",
+                 out_format="netCDF",
+                 max_workers=4,
+                 poll_interval=10,
+                 max_poll_interval=120):
+    # submits one batch job per entry of jobs = {name: (bbox, temporal_extent)} from the saved process,
+    # polls them concurrently with exponential backoff and downloads finished results to out_dir/name;
+    # returns {name: job id} with the exception instead of the job id for jobs that failed, so that
+    # one failed job does not lose the others
+    def run_job(name, bbox, temporal_extent):
+        snowmap = conn.datacube_from_process(
+            process_id,
+            namespace="user",
+            bbox={'west':bbox[0], 'east':bbox[2], 'south':bbox[1], 'north':bbox[3], 'crs':4326},
+            temporal_extent=temporal_extent)
+        job = snowmap.create_job(title=name, out_format=out_format)
+        job.start()
+        
+        delay = poll_interval
+        status = job.status()
+        while status not in ("finished", "error", "canceled"):
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+            status = job.status()
+        if status != "finished":
+            raise RuntimeError("Job {} ({}) ended with status {}".format(name, job.job_id, status))
+        
+        job.get_results().download_files(os.path.join(out_dir, name))
+        return job.job_id
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(run_job, name, bbox, temporal_extent)
+                   for name, (bbox, temporal_extent) in jobs.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                results[name] = error
+        return results
+
+def extract_metadata_geometry(stac_collection):
+    # bbox and polygon of the spatial extent loaded by the openEO process that produced stac_collection
+    meta_bbox = stac_collection["providers"][0]['processing:expression']['expression']['loadcollection1']['arguments']['spatial_extent']
+    bbox = [meta_bbox["west"], meta_bbox["south"], meta_bbox["east"], meta_bbox["north"]]
+    return bbox, stac.extract_metadata_geometry(bbox)
+
+def extract_metadata_time(stac_collection):
+    temporal_extent = stac_collection["providers"][0]['processing:expression']['expression']['loadcollection1']['arguments']["temporal_extent"]
+    return stac.extract_metadata_time(temporal_extent)
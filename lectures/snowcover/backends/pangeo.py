@@ -0,0 +1,280 @@
+""" Snow cover area from Sentinel-2 L2A with STAC, stackstac, xarray and dask"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+from ..lazy import gpd, rasterio, shapely, pystac, stackstac, xr, dask
+from ..bbox import plan_bbox_reads
+from ..stations import parse_station_dates
+from ..stac import STAC_URL, STAC_CACHE_DIR, filter_items, search_items
+
+
+SCL_CLOUD_CLASSES = [8, 9, 3]
+CLOUD_COVERAGE = ["eo:cloud_cover<=90"]
+
+def snow_kernel(green,
+                swir,
+                scl,
+                threshold,
+                cloud_value,
+                dtype="float32",
+                green_scale=1.0,
+                green_offset=0.0,
+                swir_scale=1.0,
+                swir_offset=0.0,
+                fill_value=None):
+    # classify one block of green, swir16 and scl values into a snowmap
+    # raw digital numbers are turned into reflectances with scale and offset (scalars or arrays
+    # broadcasting against the block, e.g. one value per time step), pixels equal to fill_value are no data
+    '''
+    0:: implies no snow
+    1:: implies snow presence
+    cloud_value:: implies cloud (integer dtypes also use it for no data)
+    '''
+    dtype = np.dtype(dtype)
+    green_raw, swir_raw = np.asarray(green), np.asarray(swir)
+    green = green_raw.astype("float32") * np.float32(green_scale) + np.float32(green_offset)
+    swir = swir_raw.astype("float32") * np.float32(swir_scale) + np.float32(swir_offset)
+    if fill_value is not None and not np.isnan(fill_value):
+        green[(green_raw == fill_value) | (swir_raw == fill_value)] = np.nan
+    if not np.issubdtype(dtype, np.floating) and np.isnan(cloud_value):
+        cloud_value = 2
+    nodata = np.nan if np.issubdtype(dtype, np.floating) else cloud_value
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndsi = (green - swir) / (green + swir)
+    
+    out = np.full(ndsi.shape, nodata, dtype=dtype)
+    valid = ~np.isnan(ndsi)
+    out[valid] = ndsi[valid] > threshold
+    out[np.isin(scl, SCL_CLOUD_CLASSES)] = cloud_value
+    return out
+
+def item_scale_offset(items, asset):
+    # (scale, offset) of the first raster:bands entry of asset for every item id, (1, 0) if not declared
+    scale_offset = {}
+    for item in items:
+        item = item.to_dict() if hasattr(item, "to_dict") else item
+        band = (item["assets"].get(asset, {}).get("raster:bands") or [{}])[0]
+        scale_offset[item["id"]] = (band.get("scale", 1.0), band.get("offset", 0.0))
+    return scale_offset
+
+def calculate_sca(bbox,
+                  temporal_extent,
+                  out_dtype="float32",
+                  dtype="float64",
+                  fill_value=None,
+                  resolution=None,
+                  chunksize=1024,
+                  resampling="nearest",
+                  catalog_url=STAC_URL,
+                  cache_dir=STAC_CACHE_DIR,
+                  items=None,
+                  threshold=0.4,
+                  cloud_value=np.nan,
+                  query=CLOUD_COVERAGE,
+                  epsg=None):
+    # dtype, fill_value, resolution, chunksize and resampling are passed to stackstac;
+    # the raw digital numbers are read in dtype (fill_value NaN for floats, 0 for integers by default)
+    # and scaled to reflectances with the scale and offset of each item inside snow_kernel
+    # catalog_url can point to a local static catalog, search results are cached in cache_dir
+    # items skips the STAC search, e.g. when they were already fetched by calculate_sca_batch
+    # threshold is the ndsi snow threshold and cloud_value the value of cloudy pixels,
+    # query filters the STAC search and epsg is the output projection (None picks the items' UTM zone)
+    spatial_extent = [bbox[0], bbox[1], bbox[2], bbox[3]]
+    bands = ['green', 'swir16', 'scl']
+    if items is None:
+        items = search_items(
+            spatial_extent,
+            temporal_extent,
+            query=query,
+            catalog_url=catalog_url,
+            cache_dir=cache_dir)
+    
+    # GDAL reads from the closest overview level when resolution is coarser than native
+    is_float = np.issubdtype(np.dtype(dtype), np.floating)
+    fill_value = np.dtype(dtype).type(fill_value if fill_value is not None else (np.nan if is_float else 0))
+    stack_options = {
+        "dtype": dtype,
+        "fill_value": fill_value,
+        "rescale": False,
+        "resolution": resolution,
+        "chunksize": chunksize,
+        "resampling": rasterio.enums.Resampling[resampling],
+    }
+    s2_cube = stackstac.stack(
+        items,
+        bounds_latlon=spatial_extent,
+        epsg=epsg,
+        assets=bands,
+        **stack_options)
+    
+    # scale and offset of every time step, e.g. processing baseline 04.00 adds an offset of -0.1
+    ids = s2_cube.coords["id"].values
+    scale_offset = {}
+    for asset in ['green', 'swir16']:
+        per_item = item_scale_offset(items, asset)
+        scale_offset[asset] = [xr.DataArray([per_item[i][k] for i in ids], dims="time") for k in range(2)]
+    
+    def kernel(green, swir, scl, green_scale, green_offset, swir_scale, swir_offset):
+        return snow_kernel(green, swir, scl, threshold, cloud_value, out_dtype,
+                           green_scale, green_offset, swir_scale, swir_offset, fill_value)
+    
+    # fused ndsi, snowmap and cloud mask, evaluated chunk by chunk
+    # reference: https://sentinels.copernicus.eu/web/sentinel/technical-guides/sentinel-2-msi/level-2a/algorithm-overview
+    snowmap_cloudfree = xr.apply_ufunc(
+        kernel,
+        s2_cube.sel(band='green'),
+        s2_cube.sel(band='swir16'),
+        s2_cube.sel(band='scl'),
+        *scale_offset['green'],
+        *scale_offset['swir16'],
+        dask="parallelized",
+        output_dtypes=[out_dtype],
+        keep_attrs=True)
+    
+    return snowmap_cloudfree
+
+def cube_resolution(cube):
+    # (x, y) pixel size of a stackstac cube from its raster spec, else from the coordinate spacing
+    spec = cube.attrs.get("spec")
+    if spec is not None:
+        return tuple(abs(res) for res in spec.resolutions_xy)
+    return abs(float(cube.x[1] - cube.x[0])), abs(float(cube.y[1] - cube.y[0]))
+
+def item_epsg(item):
+    # EPSG code of an item from the projection extension (proj:epsg or proj:code), None if not declared
+    properties = item.properties if hasattr(item, "properties") else item["properties"]
+    if properties.get("proj:epsg") is not None:
+        return int(properties["proj:epsg"])
+    code = properties.get("proj:code") or ""
+    return int(code.split(":")[1]) if code.upper().startswith("EPSG:") else None
+
+def dominant_epsg(items):
+    # most common item_epsg of items, None for no items
+    epsgs = collections.Counter(item_epsg(item) for item in items)
+    return epsgs.most_common(1)[0][0] if epsgs else None
+
+def calculate_sca_batch(jobs,
+                        reduce=None,
+                        share_reads=True,
+                        scheduler="threads",
+                        num_workers=None,
+                        catalog_url=STAC_URL,
+                        cache_dir=STAC_CACHE_DIR,
+                        query=CLOUD_COVERAGE,
+                        max_gap=None,
+                        **sca_options):
+    # computes calculate_sca for many (bbox, temporal_extent) jobs from a single STAC search
+    # share_reads builds one cube over the union of all jobs (one per projection, see below) so that
+    # overlapping tiles are read once;
+    # with max_gap (in degrees) the jobs are instead grouped by plan_bbox_reads into one cube per
+    # cluster of nearby boxes, which avoids reading the gaps between distant jobs;
+    # reduce is applied to each job snowmap before computing, e.g. lambda snowmap: snowmap.median("time");
+    # scheduler is any dask scheduler ("threads", "processes", "synchronous" or a distributed Client)
+    # jobs without any matching item are skipped and return None
+    union_bbox = [min(bbox[0] for bbox, _ in jobs), min(bbox[1] for bbox, _ in jobs),
+                  max(bbox[2] for bbox, _ in jobs), max(bbox[3] for bbox, _ in jobs)]
+    union_extent = [min(extent[0] for _, extent in jobs), max(extent[1] for _, extent in jobs)]
+    items = search_items(
+        union_bbox,
+        union_extent,
+        query=query,
+        catalog_url=catalog_url,
+        cache_dir=cache_dir)
+    
+    job_items = [pystac.ItemCollection(filter_items(items, bbox, extent, "sentinel-2-l2a"))
+                 for bbox, extent in jobs]
+    
+    if share_reads:
+        # a stackstac cube has a single CRS: unless epsg is given, jobs are grouped by the most common
+        # projection of their own items so that jobs in different UTM zones are read into separate cubes
+        if sca_options.get("epsg") is None:
+            job_epsgs = [dominant_epsg(found) for found in job_items]
+        else:
+            job_epsgs = [sca_options["epsg"] if len(found) else None for found in job_items]
+        reads, mapping = [], np.zeros(len(jobs), dtype=int)
+        for epsg in dict.fromkeys(job_epsg for job_epsg in job_epsgs if job_epsg is not None):
+            group = np.flatnonzero([job_epsg == epsg for job_epsg in job_epsgs])
+            boxes = np.array([jobs[job][0] for job in group], dtype="float64")
+            if max_gap is None:
+                group_reads = [[*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0)]]
+                group_mapping = np.zeros(len(group), dtype=int)
+            else:
+                plan, group_mapping = plan_bbox_reads(boxes, max_gap=max_gap)
+                group_reads = plan[["west", "south", "east", "north"]].to_numpy().tolist()
+            mapping[group] = group_mapping + len(reads)
+            reads += [(read_bbox, epsg) for read_bbox in group_reads]
+        snowmaps = []
+        for read, (read_bbox, epsg) in enumerate(reads):
+            read_jobs = [jobs[job] for job in np.flatnonzero(mapping == read)]
+            read_extent = [min(extent[0] for _, extent in read_jobs), max(extent[1] for _, extent in read_jobs)]
+            read_items = items if len(reads) == 1 else pystac.ItemCollection(
+                filter_items(items, read_bbox, read_extent, "sentinel-2-l2a"))
+            snowmaps.append(calculate_sca(read_bbox, read_extent, items=read_items, **{**sca_options, "epsg": epsg}))
+    
+    results = {}
+    for job, (bbox, temporal_extent) in enumerate(jobs):
+        if not len(job_items[job]):
+            continue
+        if share_reads:
+            # pixels are labelled by their top-left corner: the pixels west and north of the bbox
+            # edges still cover it, as in the cube calculate_sca reads for the job on its own
+            snowmap = snowmaps[mapping[job]]
+            epsg = int(snowmap.coords["epsg"])
+            res_x, res_y = cube_resolution(snowmap)
+            minx, miny, maxx, maxy = gpd.GeoSeries([shapely.geometry.box(*bbox)], crs=4326).to_crs(epsg).total_bounds
+            job_snowmap = snowmap.sel(x=slice(minx - res_x, maxx),
+                                      y=slice(maxy + res_y, miny),
+                                      time=slice(temporal_extent[0], temporal_extent[1]))
+        else:
+            job_snowmap = calculate_sca(bbox, temporal_extent, items=job_items[job], **sca_options)
+        results[job] = reduce(job_snowmap) if reduce else job_snowmap
+    
+    compute_options = {"num_workers": num_workers} if num_workers else {}
+    computed = dict(zip(results, dask.compute(*results.values(), scheduler=scheduler, **compute_options)))
+    return [computed.get(job) for job in range(len(jobs))]
+
+def sample_snow_at_stations(snowmap,
+                            stations,
+                            crs=None,
+                            tolerance=None,
+                            cloud_value=np.nan,
+                            xy_coords="topleft",
+                            date_format='%d.%m.%y'):
+    # samples the snowmap (e.g. from calculate_sca) for every station/date row of stations
+    # with one pointwise nearest selection and returns stations with a cube_snow column;
+    # acquisitions of the same day are combined with max over their cloud free values (a day is cloud_value
+    # only when all its acquisitions are cloudy), dates without acquisition are NaN
+    # xy_coords tells whether the snowmap coordinates are the pixels' "topleft" corners (the stackstac
+    # default) or their "center"; string station dates are parsed with parse_station_dates and date_format
+    crs = crs or "EPSG:{}".format(int(snowmap.coords["epsg"]))
+    keys = ["Longitude", "Latitude"]
+    locations = stations[keys].drop_duplicates()
+    location_idx = pd.MultiIndex.from_frame(locations).get_indexer(pd.MultiIndex.from_frame(stations[keys]))
+    location_points = gpd.GeoSeries(
+        gpd.points_from_xy(locations.Longitude, locations.Latitude), crs="EPSG:4326").to_crs(crs)
+    
+    x, y = location_points.x.to_numpy(), location_points.y.to_numpy()
+    if xy_coords == "topleft":
+        # shift the stations so that the nearest label is the corner of the pixel they fall into
+        res_x, res_y = cube_resolution(snowmap)
+        x, y = x - res_x / 2, y + res_y / 2
+    points = snowmap.sel(x=xr.DataArray(x, dims="location"),
+                         y=xr.DataArray(y, dims="location"),
+                         method="nearest",
+                         tolerance=tolerance)
+    
+    days = points.time.dt.floor("D")
+    clear = points.where(points != cloud_value).groupby(days).max("time")
+    cloudy = (points == cloud_value).groupby(days).any("time")
+    points = clear.where(clear.notnull() | ~cloudy, cloud_value).rename({"floor": "time"})
+    
+    dates = parse_station_dates(stations.index, date_format).normalize()
+    time_idx = points.indexes["time"].get_indexer(dates)
+    values = points.isel(time=xr.DataArray(np.maximum(time_idx, 0), dims="row"),
+                         location=xr.DataArray(location_idx, dims="row")).values
+    values = np.where(time_idx >= 0, values, np.nan)
+    return stations.assign(cube_snow=values)
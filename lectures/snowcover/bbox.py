@@ -0,0 +1,155 @@
+""" Bounding boxes of the areas of interest and planning of the reads covering many of them"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from .lazy import gpd, shapely, pyproj
+
+
+def create_bounding_box(latitude, longitude, distance_km):
+    # create a bounding box around a point
+    
+    # Radius of the Earth in kilometers
+    earth_radius_km = 6371
+
+    # Convert latitude and longitude from degrees to radians
+    lat_rad = math.radians(latitude)
+    lon_rad = math.radians(longitude)
+
+    # Calculate the angular distance covered by the given distance_km
+    angular_distance = distance_km / earth_radius_km
+
+    # Calculate the latitude and longitude offsets
+    lat_offset = math.degrees(angular_distance)
+    lon_offset = math.degrees(angular_distance / math.cos(lat_rad))
+
+    # Calculate the coordinates of the southwest and northeast corners
+    sw_lat = latitude - lat_offset
+    sw_lon = longitude - lon_offset
+    ne_lat = latitude + lat_offset
+    ne_lon = longitude + lon_offset
+    
+    return (sw_lat, sw_lon, ne_lat, ne_lon)
+
+def create_bounding_boxes(latitude, longitude, distance_km, order="wsen", crs=None, densify_pts=21):
+    # vectorised create_bounding_box for arrays of points (and distances), returns an (N, 4) array
+    # with the columns in order, a permutation of "wsen" (west, south, east, north) -- use "swne" for
+    # the ordering of create_bounding_box
+    # boxes reaching a pole are clamped to +-90 and span all longitudes; boxes crossing the antimeridian
+    # are wrapped to [-180, 180] with west > east, as in GeoJSON and STAC
+    # crs projects the boxes with pyproj, their bounds are taken over densify_pts points per edge
+    earth_radius_km = 6371
+    if sorted(order) != sorted("wsen"):
+        raise ValueError("order must be a permutation of 'wsen', got {!r}".format(order))
+    latitude, longitude, distance_km = np.broadcast_arrays(
+        np.asarray(latitude, dtype="float64"),
+        np.asarray(longitude, dtype="float64"),
+        np.asarray(distance_km, dtype="float64"))
+    latitude, longitude, distance_km = latitude.ravel(), longitude.ravel(), distance_km.ravel()
+    
+    lat_offset = np.degrees(distance_km / earth_radius_km)
+    with np.errstate(divide="ignore"):
+        lon_offset = np.degrees(distance_km / earth_radius_km / np.cos(np.radians(latitude)))
+    south = np.maximum(latitude - lat_offset, -90)
+    north = np.minimum(latitude + lat_offset, 90)
+    full_lon = (np.abs(latitude) + lat_offset >= 90) | ~(lon_offset < 180)
+    west = np.where(full_lon, -180, longitude - lon_offset)
+    east = np.where(full_lon, 180, longitude + lon_offset)
+    
+    if crs is not None:
+        # unwrapped longitudes (beyond +-180) keep each box contiguous for the projection
+        t = np.linspace(0, 1, densify_pts)
+        lon = np.concatenate([west[:, None] + (east - west)[:, None] * t,
+                              np.broadcast_to(east[:, None], (len(east), densify_pts)),
+                              east[:, None] - (east - west)[:, None] * t,
+                              np.broadcast_to(west[:, None], (len(west), densify_pts))], axis=1)
+        lat = np.concatenate([np.broadcast_to(south[:, None], (len(south), densify_pts)),
+                              south[:, None] + (north - south)[:, None] * t,
+                              np.broadcast_to(north[:, None], (len(north), densify_pts)),
+                              north[:, None] - (north - south)[:, None] * t], axis=1)
+        transformer = pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+        x, y = transformer.transform(lon, lat)
+        west, south, east, north = x.min(axis=1), y.min(axis=1), x.max(axis=1), y.max(axis=1)
+    else:
+        west = np.where(west < -180, west + 360, west)
+        east = np.where(east > 180, east - 360, east)
+    
+    columns = {"w": west, "s": south, "e": east, "n": north}
+    return np.column_stack([columns[axis] for axis in order])
+
+def visualize_bbox(map_layer, bbox):
+    # Create polygon from lists of points
+    x = [bbox[0], bbox[0], bbox[2], bbox[2], bbox[0]]
+    y = [bbox[1], bbox[3], bbox[3], bbox[1], bbox[1]]
+    poly = shapely.geometry.Polygon(zip(x,y))
+    gs = gpd.GeoSeries.from_wkt([str(poly)])
+    gdf = gpd.GeoDataFrame({"col1": ["bbox"]}, geometry=gs, crs=4326)
+    #visualize generated bounding box
+    return map_layer.add_gdf(gdf)
+
+def find_root(parent, i):
+    # root of i in the union-find forest parent, halving the path on the way
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def plan_bbox_reads(bboxes, max_gap=0, resolution=None, origin=(0, 0), tiles=None, tile_column="Name"):
+    # groups requested (west, south, east, north) boxes into fewer, larger reads: boxes closer than
+    # max_gap (found with an R-tree) are merged into their union, repeated until no reads overlap,
+    # so that overlapping requests read each pixel once
+    # resolution snaps the reads outwards to a fixed pixel grid anchored at origin, in bbox units
+    # tiles, e.g. a GeoDataFrame of the Sentinel-2 MGRS tiles, adds the tile_column values each read touches
+    # returns the plan as a DataFrame with one row per read and, for every request, its row in the plan
+    boxes = np.asarray(bboxes, dtype="float64").reshape(-1, 4)
+    mapping = np.arange(len(boxes))
+    
+    def align(boxes):
+        if resolution is None:
+            return boxes
+        x = (boxes[:, [0, 2]] - origin[0]) / resolution
+        y = (boxes[:, [1, 3]] - origin[1]) / resolution
+        return np.column_stack([np.floor(x[:, 0]) * resolution + origin[0],
+                                np.floor(y[:, 0]) * resolution + origin[1],
+                                np.ceil(x[:, 1]) * resolution + origin[0],
+                                np.ceil(y[:, 1]) * resolution + origin[1]])
+    
+    boxes = align(boxes)
+    while True:
+        # candidate pairs from the R-tree, then only pairs overlapping or strictly closer than max_gap
+        tree = shapely.STRtree(shapely.box(*boxes.T))
+        left, right = tree.query(shapely.box(*(boxes + [-max_gap, -max_gap, max_gap, max_gap]).T),
+                                 predicate="intersects")
+        gap_x = np.maximum(boxes[left, 0], boxes[right, 0]) - np.minimum(boxes[left, 2], boxes[right, 2])
+        gap_y = np.maximum(boxes[left, 1], boxes[right, 1]) - np.minimum(boxes[left, 3], boxes[right, 3])
+        close = (left < right) & (np.maximum(gap_x, gap_y) < max_gap)
+        if not close.any():
+            break
+        
+        # connected components with union-find
+        parent = np.arange(len(boxes))
+        for a, b in zip(left[close], right[close]):
+            root_a, root_b = find_root(parent, a), find_root(parent, b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        _, labels = np.unique([find_root(parent, i) for i in range(len(boxes))], return_inverse=True)
+        
+        merged = np.empty((labels.max() + 1, 4))
+        merged[:, :2] = np.inf
+        merged[:, 2:] = -np.inf
+        np.minimum.at(merged[:, 0], labels, boxes[:, 0])
+        np.minimum.at(merged[:, 1], labels, boxes[:, 1])
+        np.maximum.at(merged[:, 2], labels, boxes[:, 2])
+        np.maximum.at(merged[:, 3], labels, boxes[:, 3])
+        boxes = align(merged)
+        mapping = labels[mapping]
+    
+    plan = pd.DataFrame(boxes, columns=["west", "south", "east", "north"])
+    plan["n_requests"] = np.bincount(mapping, minlength=len(plan))
+    if tiles is not None:
+        reads = gpd.GeoDataFrame(geometry=shapely.box(*boxes.T), crs=tiles.crs)
+        touched = gpd.sjoin(reads, tiles[[tile_column, "geometry"]], predicate="intersects")
+        plan["tiles"] = touched.groupby(level=0)[tile_column].agg(sorted).reindex(plan.index)
+    return plan, mapping
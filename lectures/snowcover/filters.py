@@ -0,0 +1,24 @@
+""" Parsing of STAC query strings and combination of filter expressions"""
+
+import re
+import operator
+import functools
+
+
+QUERY_OPERATORS = {"<=": operator.le, ">=": operator.ge, "<": operator.lt, ">": operator.gt, "=": operator.eq}
+
+def parse_query(query):
+    # (name, operator, value) for every query string like "eo:cloud_cover<=90", numeric values become floats
+    conditions = []
+    for q in query or []:
+        name, op, value = re.match(r"(.+?)(<=|>=|<|>|=)(.+)", q).groups()
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        conditions.append((name, QUERY_OPERATORS[op], value))
+    return conditions
+
+def combine_filters(filters):
+    # all filters (e.g. pyarrow dataset expressions) combined with &, None for no filters
+    return functools.reduce(operator.and_, filters) if filters else None
@@ -0,0 +1,51 @@
+""" Lazy imports of the heavy geospatial, STAC and datacube libraries"""
+
+import os
+import time
+import importlib
+import importlib.util
+import subprocess
+import sys
+
+
+class LazyModule:
+    # stands in for a heavy module and imports it, or one of its submodules, on first attribute access
+    def __init__(self, name):
+        self._name = name
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            return importlib.import_module(self._name + "." + attr)
+
+# geospatial, STAC and datacube libraries are only imported on first use
+gpd = LazyModule("geopandas")
+rasterio = LazyModule("rasterio")
+shapely = LazyModule("shapely")
+pystac = LazyModule("pystac")
+pystac_client = LazyModule("pystac_client")
+stackstac = LazyModule("stackstac")
+xr = LazyModule("xarray")
+dask = LazyModule("dask")
+rio_stac = LazyModule("rio_stac")
+gdal = LazyModule("osgeo.gdal")
+pyproj = LazyModule("pyproj")
+
+def benchmark_import(module_name="snowcover", number=5, cwd=None):
+    # seconds to import module_name in a fresh interpreter started in cwd, averaged over number runs;
+    # cwd defaults to the directory module_name is found in (e.g. the exercise directory of a
+    # _3x_*_utilities module), else to the directory containing the snowcover package
+    if cwd is None:
+        spec = importlib.util.find_spec(module_name.split(".")[0])
+        if spec is not None and spec.origin and os.path.exists(spec.origin):
+            cwd = os.path.dirname(os.path.abspath(spec.origin))
+            if spec.submodule_search_locations is not None:
+                cwd = os.path.dirname(cwd)
+        else:
+            cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    for _ in range(number):
+        subprocess.run([sys.executable, "-c", "import " + module_name], cwd=cwd, check=True)
+    return (time.perf_counter() - start) / number
@@ -0,0 +1,277 @@
+""" Raster statistics and Cloud-Optimized GeoTIFFs of the snow maps, read and written with rasterio
+(engine="rasterio") or with the GDAL python bindings (engine="gdal")"""
+
+import os
+import math
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .lazy import rasterio, gdal
+
+
+def window_moments(values, nodata=None, hist_range=None, buckets=256):
+    # count, mean, sum of squared deviations, min, max and histogram of the valid values of one window
+    values = values.ravel()
+    valid = np.isfinite(values)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= values != nodata
+    values = values[valid].astype("float64")
+    hist = np.histogram(values, bins=buckets, range=hist_range)[0] if hist_range else None
+    if values.size == 0:
+        return {"count": 0, "mean": 0.0, "m2": 0.0, "min": np.inf, "max": -np.inf, "hist": hist}
+    mean = values.mean()
+    return {"count": values.size, "mean": mean, "m2": ((values - mean)**2).sum(),
+            "min": values.min(), "max": values.max(), "hist": hist}
+
+def merge_moments(a, b):
+    # exact merge of two window_moments results (Chan et al. parallel variance)
+    count = a["count"] + b["count"]
+    if count == 0:
+        return a
+    delta = b["mean"] - a["mean"]
+    return {"count": count,
+            "mean": a["mean"] + delta * b["count"] / count,
+            "m2": a["m2"] + b["m2"] + delta**2 * a["count"] * b["count"] / count,
+            "min": min(a["min"], b["min"]),
+            "max": max(a["max"], b["max"]),
+            "hist": None if a["hist"] is None else a["hist"] + b["hist"]}
+
+def write_pam_statistics(aux_path, stats, hist_range=None, nodata=None):
+    # stores per band statistics, histograms and nodata (one value for all bands or a list with one per band)
+    # in a GDAL PAM .aux.xml document, keeping what else it already contains;
+    # GDAL picks up <raster>.aux.xml next to a raster automatically
+    root = ET.parse(aux_path).getroot() if os.path.exists(aux_path) else ET.Element("PAMDataset")
+    band_nodata = nodata if isinstance(nodata, (list, tuple)) else [nodata] * len(stats)
+    for band, s in enumerate(stats):
+        band_el = root.find("PAMRasterBand[@band='{}']".format(band+1))
+        if band_el is None:
+            band_el = ET.SubElement(root, "PAMRasterBand", band=str(band+1))
+        if band_nodata[band] is not None:
+            for el in band_el.findall("NoDataValue"):
+                band_el.remove(el)
+            ET.SubElement(band_el, "NoDataValue").text = repr(float(band_nodata[band]))
+        if s["hist"] is not None:
+            for el in band_el.findall("Histograms"):
+                band_el.remove(el)
+            item = ET.SubElement(ET.SubElement(band_el, "Histograms"), "HistItem")
+            for tag, value in [("HistMin", hist_range[0]), ("HistMax", hist_range[1]),
+                               ("BucketCount", len(s["hist"])), ("IncludeOutOfRange", 0), ("Approximate", 0),
+                               ("HistCounts", "|".join(str(int(c)) for c in s["hist"]))]:
+                ET.SubElement(item, tag).text = str(value)
+        if s["count"]:
+            metadata = band_el.find("Metadata")
+            if metadata is None:
+                metadata = ET.SubElement(band_el, "Metadata")
+            for key, value in [("STATISTICS_MINIMUM", s["min"]), ("STATISTICS_MAXIMUM", s["max"]),
+                               ("STATISTICS_MEAN", s["mean"]),
+                               ("STATISTICS_STDDEV", math.sqrt(s["m2"] / s["count"]))]:
+                for el in metadata.findall("MDI[@key='{}']".format(key)):
+                    metadata.remove(el)
+                ET.SubElement(metadata, "MDI", key=key).text = repr(float(value))
+    ET.ElementTree(root).write(aux_path)
+    return aux_path
+
+class RasterioReader:
+    # the few raster operations used by compute_raster_stats, write_cog and validate_cog on a rasterio dataset
+    def __init__(self, path):
+        self.dataset = rasterio.open(path)
+        self.width, self.height, self.count = self.dataset.width, self.dataset.height, self.dataset.count
+        self.block_rows, self.block_cols = self.dataset.block_shapes[0]
+        self.nodata = list(self.dataset.nodatavals)
+        self.dtype = np.dtype(self.dataset.dtypes[0])
+    
+    def read_rows(self, row, rows):
+        # (count, rows, width) array of the rows starting at row
+        return self.dataset.read(window=rasterio.windows.Window(0, row, self.width, rows))
+    
+    def cog_layout(self):
+        return {"layout": self.dataset.tags(ns="IMAGE_STRUCTURE").get("LAYOUT"),
+                "block_cols": self.block_cols,
+                "overviews": len(self.dataset.overviews(1)),
+                "nodata": self.dataset.nodata}
+    
+    def write_cog(self, windows, cog_path, nodata, creation_options):
+        # writes the (row, uint8 values) windows with the georeferencing of this raster into a tiled
+        # temporary GTiff next to cog_path, which is then copied through the COG driver
+        blocksize = creation_options["BLOCKSIZE"]
+        profile = {key: value for key, value in self.dataset.profile.items() if key not in ("compress", "predictor")}
+        profile.update(driver="GTiff", dtype="uint8", nodata=nodata, tiled=True,
+                       blockxsize=blocksize, blockysize=blocksize, BIGTIFF="IF_SAFER")
+        fd, tmp_path = tempfile.mkstemp(suffix=".tif", dir=os.path.dirname(os.path.abspath(cog_path)))
+        os.close(fd)
+        try:
+            with rasterio.open(tmp_path, "w", **profile) as tmp:
+                for row, values in windows:
+                    tmp.write(values, window=rasterio.windows.Window(0, row, self.width, values.shape[1]))
+            rasterio.shutil.copy(tmp_path, cog_path, driver="COG", **creation_options)
+        finally:
+            os.remove(tmp_path)
+    
+    def close(self):
+        self.dataset.close()
+
+class GdalReader:
+    # the few raster operations used by compute_raster_stats, write_cog and validate_cog on a GDAL dataset
+    def __init__(self, path):
+        self.dataset = gdal.Open(path)
+        self.width, self.height = self.dataset.RasterXSize, self.dataset.RasterYSize
+        self.count = self.dataset.RasterCount
+        band = self.dataset.GetRasterBand(1)
+        self.block_cols, self.block_rows = band.GetBlockSize()
+        self.nodata = [self.dataset.GetRasterBand(i+1).GetNoDataValue() for i in range(self.count)]
+        self.dtype = band.ReadAsArray(0, 0, 1, 1).dtype
+    
+    def read_rows(self, row, rows):
+        # (count, rows, width) array of the rows starting at row
+        return self.dataset.ReadAsArray(0, row, self.width, rows).reshape(self.count, rows, self.width)
+    
+    def cog_layout(self):
+        band = self.dataset.GetRasterBand(1)
+        return {"layout": self.dataset.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE"),
+                "block_cols": self.block_cols,
+                "overviews": band.GetOverviewCount(),
+                "nodata": band.GetNoDataValue()}
+    
+    def write_cog(self, windows, cog_path, nodata, creation_options):
+        # writes the (row, uint8 values) windows with the georeferencing of this raster into a tiled
+        # temporary GTiff next to cog_path, which is then copied through the COG driver
+        blocksize = creation_options["BLOCKSIZE"]
+        fd, tmp_path = tempfile.mkstemp(suffix=".tif", dir=os.path.dirname(os.path.abspath(cog_path)))
+        os.close(fd)
+        try:
+            tmp = gdal.GetDriverByName("GTiff").Create(
+                tmp_path, self.width, self.height, self.count, gdal.GDT_Byte,
+                ["TILED=YES", "BLOCKXSIZE={}".format(blocksize), "BLOCKYSIZE={}".format(blocksize),
+                 "BIGTIFF=IF_SAFER"])
+            tmp.SetGeoTransform(self.dataset.GetGeoTransform())
+            tmp.SetProjection(self.dataset.GetProjection())
+            for band in range(self.count):
+                tmp.GetRasterBand(band+1).SetNoDataValue(nodata)
+            for row, values in windows:
+                for band in range(self.count):
+                    tmp.GetRasterBand(band+1).WriteArray(values[band], 0, row)
+            tmp = None
+            gdal.Translate(cog_path,
+                           tmp_path,
+                           format="COG",
+                           creationOptions=["{}={}".format(key, value) for key, value in creation_options.items()])
+        finally:
+            tmp = None
+            os.remove(tmp_path)
+    
+    def close(self):
+        # dropping the last reference closes a GDAL dataset
+        self.dataset = None
+
+RASTER_READERS = {"rasterio": RasterioReader, "gdal": GdalReader}
+
+def compute_raster_stats(in_data_path,
+                         stat_data_path=None,
+                         nodata=np.nan,
+                         max_workers=None,
+                         hist_range=None,
+                         buckets=256,
+                         engine="rasterio"):
+    # computes min/max/mean/std (and a histogram for uint8 rasters or a given hist_range) of all bands
+    # in one pass over row windows on a thread pool, then stores them in the .aux.xml sidecar
+    # stat_data_path (default in_data_path + ".aux.xml") without copying or rewriting the raster
+    # pixels equal to nodata are left out and nodata is declared in the sidecar; with nodata NaN each band
+    # keeps the nodata value of the raster (NaN for float rasters without one)
+    reader_class = RASTER_READERS[engine]
+    reader = reader_class(in_data_path)
+    height, dtype = reader.height, reader.dtype
+    block_rows = reader.block_rows * max(1, 256 // reader.block_rows)
+    reader.close()
+    if hist_range is None and dtype == np.uint8:
+        hist_range = (-0.5, 255.5)
+    is_float = np.issubdtype(dtype, np.floating)
+    if nodata is not None and not np.isnan(nodata):
+        band_nodata = [nodata] * len(reader.nodata)
+    else:
+        band_nodata = [value if value is not None else (np.nan if is_float else None) for value in reader.nodata]
+    
+    local = threading.local()
+    readers = []
+    def window_stats(row):
+        # dataset handles are not thread safe, each worker thread opens its own
+        if not hasattr(local, "reader"):
+            local.reader = reader_class(in_data_path)
+            readers.append(local.reader)
+        data = local.reader.read_rows(row, min(block_rows, height - row)).reshape(len(band_nodata), -1)
+        return [window_moments(data[band], band_nodata[band], hist_range, buckets)
+                for band in range(len(band_nodata))]
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stats = None
+            for window in executor.map(window_stats, range(0, height, block_rows)):
+                stats = window if stats is None else [merge_moments(a, b) for a, b in zip(stats, window)]
+    finally:
+        for thread_reader in readers:
+            thread_reader.close()
+    
+    # save raster statistics
+    write_pam_statistics(stat_data_path or in_data_path + ".aux.xml", stats, hist_range, band_nodata)
+    return stats
+
+def snow_classes_uint8(values, src_nodata=None, nodata=255):
+    # snow map classes (0 no snow, 1 snow, 2 cloud) as uint8, NaN and src_nodata pixels become nodata
+    values = np.asarray(values)
+    missing = ~np.isfinite(values) if np.issubdtype(values.dtype, np.floating) else np.zeros(values.shape, bool)
+    if src_nodata is not None and not np.isnan(src_nodata):
+        missing |= values == src_nodata
+    classes = np.where(missing, 0, values).astype("uint8")
+    classes[missing] = nodata
+    return classes
+
+def write_cog(in_data_path,
+              cog_path,
+              nodata=255,
+              compress="DEFLATE",
+              blocksize=512,
+              overview_resampling="NEAREST",
+              engine="rasterio"):
+    # writes the snow map as a uint8 Cloud-Optimized GeoTIFF with internal tiling, compression with predictor
+    # and internal overviews; missing pixels (NaN or the source nodata) are set to nodata, which must not
+    # be one of the classes
+    # the raster is converted blocksize rows at a time into a tiled temporary GTiff, so that it is
+    # never held in memory as a whole
+    reader = RASTER_READERS[engine](in_data_path)
+    def windows():
+        for row in range(0, reader.height, blocksize):
+            data = reader.read_rows(row, min(blocksize, reader.height - row))
+            yield row, np.stack([snow_classes_uint8(data[band], reader.nodata[band], nodata)
+                                 for band in range(reader.count)])
+    
+    try:
+        reader.write_cog(windows(), cog_path, nodata, {"COMPRESS": compress,
+                                                       "PREDICTOR": "YES",
+                                                       "BLOCKSIZE": blocksize,
+                                                       "OVERVIEWS": "AUTO",
+                                                       "OVERVIEW_RESAMPLING": overview_resampling})
+    finally:
+        reader.close()
+    return validate_cog(cog_path, engine)
+
+def validate_cog(cog_path, engine="rasterio"):
+    # returns a list of layout problems, empty for a valid COG
+    reader = RASTER_READERS[engine](cog_path)
+    try:
+        layout = reader.cog_layout()
+        width, height = reader.width, reader.height
+    finally:
+        reader.close()
+    errors = []
+    if layout["layout"] != "COG":
+        errors.append("not laid out as a COG")
+    if layout["block_cols"] == width and width > 512:
+        errors.append("not internally tiled")
+    if not layout["overviews"] and max(width, height) > 512:
+        errors.append("no internal overviews")
+    if layout["nodata"] is None:
+        errors.append("no nodata value")
+    return errors
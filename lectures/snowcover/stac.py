@@ -0,0 +1,462 @@
+""" STAC search with an on-disk cache and a shared client, and STAC metadata of the generated snow maps"""
+
+import os
+import re
+import shutil
+import json
+import time
+import threading
+import hashlib
+import tempfile
+import collections
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .lazy import rasterio, pystac, pystac_client, rio_stac
+from .filters import parse_query, combine_filters
+
+
+STAC_URL = "https://earth-search.aws.element84.com/v1"
+STAC_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cubes_and_clouds", "stac")
+
+def stac_cache_key(*parts):
+    # stable hash of the request parameters used as cache file name
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def read_stac_cache(key, cache_dir=STAC_CACHE_DIR, ttl=86400):
+    # returns the cached json document or None if missing or older than ttl seconds
+    path = os.path.join(cache_dir, key + ".json")
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        # missing, or evicted by another writer in the meantime
+        return None
+
+def write_stac_cache(key, data, cache_dir=STAC_CACHE_DIR, max_size_mb=256):
+    # stores a json document and evicts the oldest entries above max_size_mb; safe to call from
+    # several threads or processes: every write goes through its own temporary file and entries
+    # removed by a concurrent writer are skipped
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + ".json")
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    
+    entries = []
+    for f in os.listdir(cache_dir):
+        if f.endswith(".json"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, f))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, f)))
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, oldest in entries:
+        if total_size <= max_size_mb * 1024**2:
+            break
+        try:
+            os.remove(oldest)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+STAC_CLIENTS = {}
+STAC_CLIENTS_LOCK = threading.Lock()
+# timings of the most recent requests only, so that long batch runs do not grow it without bound
+STAC_REQUEST_TIMINGS = collections.deque(maxlen=10000)
+
+def record_stac_timing(response, *args, **kwargs):
+    # requests response hook collecting request level timings in STAC_REQUEST_TIMINGS
+    STAC_REQUEST_TIMINGS.append({"method": response.request.method,
+                                 "url": response.url,
+                                 "status": response.status_code,
+                                 "seconds": response.elapsed.total_seconds()})
+
+def pop_stac_timings():
+    # returns the collected request timings as a DataFrame and starts over
+    timings = []
+    while STAC_REQUEST_TIMINGS:
+        timings.append(STAC_REQUEST_TIMINGS.popleft())
+    return pd.DataFrame(timings, columns=["method", "url", "status", "seconds"])
+
+def stac_api_io(pool_size=16, retries=5, backoff_factor=0.5, timeout=30):
+    # StacApiIO on a pooled session that retries rate limits and server errors with exponential backoff
+    from pystac_client.stac_api_io import StacApiIO
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["GET", "POST"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    stac_io = StacApiIO(timeout=timeout)
+    stac_io.session.mount("https://", adapter)
+    stac_io.session.mount("http://", adapter)
+    stac_io.session.hooks["response"].append(record_stac_timing)
+    return stac_io
+
+def open_catalog(catalog_url=STAC_URL):
+    # STAC API endpoints are opened with pystac_client, anything else as a static catalog;
+    # API clients are shared per url so that all calls reuse the same connection pool
+    if catalog_url.startswith(("http://", "https://")) and not catalog_url.endswith(".json"):
+        with STAC_CLIENTS_LOCK:
+            if catalog_url not in STAC_CLIENTS:
+                STAC_CLIENTS[catalog_url] = pystac_client.Client.open(catalog_url, stac_io=stac_api_io())
+            return STAC_CLIENTS[catalog_url]
+    return pystac.Catalog.from_file(catalog_url)
+
+def filter_items(items, bbox, temporal_extent, collection, query=None):
+    # minimal bbox, datetime and query filter for static catalogs and already fetched items
+    conditions = parse_query(query)
+    
+    start = pystac.utils.str_to_datetime(temporal_extent[0]).date()
+    end = pystac.utils.str_to_datetime(temporal_extent[1]).date()
+    for item in items:
+        if item.collection_id != collection:
+            continue
+        if (item.bbox[0] > bbox[2] or item.bbox[2] < bbox[0]
+                or item.bbox[1] > bbox[3] or item.bbox[3] < bbox[1]):
+            continue
+        item_date = (item.datetime or pystac.utils.str_to_datetime(item.properties["start_datetime"])).date()
+        if not start <= item_date <= end:
+            continue
+        if all(name in item.properties and op(item.properties[name], value)
+               for name, op, value in conditions):
+            yield item
+
+def search_items(bbox,
+                 temporal_extent,
+                 collection="sentinel-2-l2a",
+                 query=None,
+                 catalog_url=STAC_URL,
+                 cache_dir=STAC_CACHE_DIR,
+                 ttl=86400):
+    # STAC search with an on-disk cache of the resulting item collection, set cache_dir=None to disable
+    key = stac_cache_key("search", catalog_url, collection, list(bbox), temporal_extent, query)
+    cached = read_stac_cache(key, cache_dir, ttl) if cache_dir else None
+    if cached is not None:
+        return pystac.ItemCollection.from_dict(cached)
+    
+    catalog = open_catalog(catalog_url)
+    if isinstance(catalog, pystac_client.Client):
+        items = catalog.search(
+            bbox=list(bbox),
+            datetime=temporal_extent,
+            query=query,
+            collections=[collection]).item_collection()
+    else:
+        items = pystac.ItemCollection(
+            filter_items(catalog.get_items(recursive=True), bbox, temporal_extent, collection, query))
+    
+    if cache_dir:
+        write_stac_cache(key, items.to_dict(), cache_dir)
+    return items
+
+def search_items_concurrently(searches, max_workers=8, **search_options):
+    # runs search_items for many (bbox, temporal_extent) pairs at once on the shared client,
+    # pages of one search stay sequential since each one links to the next
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda search: search_items(*search, **search_options), searches))
+
+ASSET_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cubes_and_clouds", "assets")
+
+def introspect_asset(path, cache_dir=ASSET_CACHE_DIR):
+    # footprint, acquisition date, projection, raster and eo band information of one raster,
+    # memoised on disk by (path, mtime, size) so unchanged files are not read again
+    stat = os.stat(path)
+    key = stac_cache_key("asset", os.path.abspath(path), stat.st_mtime, stat.st_size)
+    cached = read_stac_cache(key, cache_dir, ttl=np.inf) if cache_dir else None
+    if cached is not None:
+        return cached
+    
+    with rasterio.open(path) as src_dst:
+        # Try to get datetime from https://gdal.org/user/raster_data_model.html#imagery-domain-remote-sensing
+        info = {
+            "name": src_dst.name,
+            "bbox": rio_stac.stac.get_dataset_geom(src_dst, densify_pts=0, precision=-1)["bbox"],
+            "datetime": src_dst.get_tag_item("ACQUISITIONDATETIME", "IMAGERY"),
+            "proj_info": {
+                f"proj:{name}": value
+                for name, value in rio_stac.stac.get_projection_info(src_dst).items()
+            },
+            "raster_info": {"raster:bands": rio_stac.stac.get_raster_info(src_dst, max_size=1024)},
+            "eo_info": {"eo:bands": rio_stac.stac.get_eobands_info(src_dst)},
+            "cloudcover": src_dst.get_tag_item("CLOUDCOVER", "IMAGERY"),
+        }
+    # numpy scalars are turned into plain python numbers so the result is json serialisable
+    info = json.loads(json.dumps(info, default=lambda o: o.item() if hasattr(o, "item") else str(o)))
+    
+    if cache_dir:
+        write_stac_cache(key, info, cache_dir)
+    return info
+
+def generate_stac(assets,
+                  media_type,
+                  id="Snow_map",
+                  collection=None,
+                  collection_url=None,
+                  input_datetime=None,
+                  properties = {},
+                  max_workers=None,
+                  cache_dir=ASSET_CACHE_DIR):
+    "generates stac item or collection from a list of specified geospatial data assets"
+                       
+    extensions =[
+        f"https://stac-extensions.github.io/projection/{rio_stac.stac.PROJECTION_EXT_VERSION}/schema.json",
+        f"https://stac-extensions.github.io/raster/{rio_stac.stac.RASTER_EXT_VERSION}/schema.json",
+        f"https://stac-extensions.github.io/eo/{rio_stac.stac.EO_EXT_VERSION}/schema.json"
+    ]
+    properties = dict(properties)
+                  
+    bboxes = []
+    pystac_assets = []
+    img_datetimes = []
+
+    # assets are introspected concurrently, results come back in the order of assets
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        infos = list(executor.map(lambda asset: introspect_asset(asset["path"], cache_dir), assets))
+
+    for asset, info in zip(assets, infos):
+        bboxes.append(info["bbox"])
+
+        if "start_datetime" not in properties and "end_datetime" not in properties:
+            dst_datetime = pystac.utils.str_to_datetime(info["datetime"]) if info["datetime"] else None
+            if dst_datetime:
+                img_datetimes.append(dst_datetime)
+
+        if info["cloudcover"] is not None:
+            properties.update({"eo:cloud_cover": int(info["cloudcover"])})
+
+        pystac_assets.append(
+            (
+                asset["name"], 
+                pystac.Asset(
+                    href=asset["href"] or info["name"],
+                    media_type=media_type,
+                    extra_fields={
+                        **info["proj_info"],
+                        **info["raster_info"], 
+                        **info["eo_info"]
+                    },
+                    roles=asset["role"],
+                ),
+            )
+        )
+
+    if img_datetimes and not input_datetime:
+        input_datetime = img_datetimes[0]
+
+    input_datetime = input_datetime or datetime.utcnow()    
+
+    minx, miny, maxx, maxy = zip(*bboxes)
+    bbox = [min(minx), min(miny), max(maxx), max(maxy)]
+
+    # item
+    item = pystac.Item(
+        id=id,
+        geometry=rio_stac.stac.bbox_to_geom(bbox),
+        bbox=bbox,
+        collection=collection,
+        stac_extensions=extensions,
+        datetime=input_datetime,
+        properties=properties,
+    )
+
+    # creating collection requires to specify the link
+    if collection:
+        item.add_link(
+            pystac.Link(
+                pystac.RelType.COLLECTION,
+                collection_url or collection,
+                media_type=pystac.MediaType.JSON,
+            )
+        )
+
+    for key, asset in pystac_assets:
+        item.add_asset(key=key, asset=asset)
+    
+    return item
+
+def build_stac_collection(root_dir,
+                          out_dir,
+                          collection_id="snow_maps",
+                          description="Snow maps generated in the EO Cubes and Clouds MOOC",
+                          media_type=None,
+                          pattern=r"(?P<date>\d{4}-?\d{2}-?\d{2})(?:_(?P<tile>[0-9A-Z]{5}))?",
+                          suffixes=(".tif", ".tiff"),
+                          max_workers=None,
+                          copy_assets=True,
+                          cache_dir=ASSET_CACHE_DIR):
+    # walks root_dir, groups rasters into one item per date (and tile) matched by pattern in the
+    # file name, generates the items concurrently with generate_stac and saves a self-contained
+    # static catalog with the collection in out_dir; assets are keyed by their path relative to root_dir
+    # (without suffix, "/" separated) so that equally named rasters of different directories are kept apart
+    # copy_assets copies the rasters next to their item in out_dir; without it the asset hrefs are
+    # relative links back into root_dir and the catalog only works together with root_dir
+    # cache_dir is passed to introspect_asset, None disables the cache
+    media_type = media_type or pystac.MediaType.COG
+    groups = {}
+    for dirpath, _, files in os.walk(root_dir):
+        for file in sorted(files):
+            match = re.search(pattern, file)
+            if file.lower().endswith(suffixes) and match:
+                key = (match["date"], match.groupdict().get("tile") or "")
+                groups.setdefault(key, []).append(os.path.abspath(os.path.join(dirpath, file)))
+    
+    def make_item(key):
+        date, tile = key
+        assets = [{"name": os.path.splitext(os.path.relpath(path, root_dir))[0].replace(os.sep, "/"),
+                   "path": path,
+                   "href": path,
+                   "role": ["data"]} for path in groups[key]]
+        return generate_stac(assets,
+                             media_type,
+                             id="_".join(filter(None, [collection_id, date.replace("-", ""), tile])),
+                             input_datetime=pystac.utils.str_to_datetime(date),
+                             max_workers=1,
+                             cache_dir=cache_dir)
+    
+    # extents are updated as items come in
+    bbox = [np.inf, np.inf, -np.inf, -np.inf]
+    start, end = None, None
+    items = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in executor.map(make_item, sorted(groups)):
+            bbox = [min(bbox[0], item.bbox[0]), min(bbox[1], item.bbox[1]),
+                    max(bbox[2], item.bbox[2]), max(bbox[3], item.bbox[3])]
+            start = item.datetime if start is None else min(start, item.datetime)
+            end = item.datetime if end is None else max(end, item.datetime)
+            items.append(item)
+    
+    collection = pystac.Collection(
+        id=collection_id,
+        description=description,
+        extent=pystac.Extent(pystac.SpatialExtent([bbox]), pystac.TemporalExtent([[start, end]])))
+    collection.add_items(items)
+    collection.normalize_hrefs(out_dir)
+    if copy_assets:
+        for item in items:
+            item_dir = os.path.dirname(item.get_self_href())
+            os.makedirs(item_dir, exist_ok=True)
+            for name, asset in item.assets.items():
+                target = os.path.join(item_dir, *name.split("/")) + os.path.splitext(asset.href)[1]
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(asset.href, target)
+                asset.href = target
+    collection.make_all_asset_hrefs_relative()
+    collection.save(catalog_type=pystac.CatalogType.SELF_CONTAINED)
+    return collection
+
+def utc_timestamp(timestamp):
+    # timestamp as a UTC pd.Timestamp, naive input is taken to be UTC already
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_convert("UTC") if timestamp.tzinfo is not None else timestamp.tz_localize("UTC")
+
+def export_stac_geoparquet(items, path, chunk_size=10000):
+    # writes the items as stac-geoparquet (https://github.com/stac-utils/stac-geoparquet): one row per item
+    # with a bbox struct, a UTC datetime column and the properties as top level columns; rows are sorted
+    # by datetime and every chunk_size items form a row group, so that the row group statistics let
+    # query_stac_geoparquet skip whole row groups
+    import stac_geoparquet.arrow
+    
+    def item_datetime(item):
+        return utc_timestamp(item.datetime or pystac.utils.str_to_datetime(item.properties["start_datetime"]))
+    
+    item_dicts = [item.to_dict() for item in sorted(items, key=item_datetime)]
+    batches = stac_geoparquet.arrow.parse_stac_items_to_arrow(item_dicts, chunk_size=chunk_size)
+    stac_geoparquet.arrow.to_parquet(batches, path)
+    return path
+
+def query_stac_geoparquet(path, bbox=None, datetime_range=None, query=None):
+    # searches a stac-geoparquet file (e.g. from export_stac_geoparquet) with the filters pushed down into
+    # the Parquet scan; bbox is (west, south, east, north), datetime_range a (start, end) pair, naive
+    # dates are UTC, and query a list like ["eo:cloud_cover<=90"]
+    import pyarrow.dataset as pads
+    import stac_geoparquet.arrow
+    
+    dataset = pads.dataset(path, format="parquet")
+    filters = []
+    if bbox is not None:
+        filters += [pads.field("bbox", "xmin") <= bbox[2], pads.field("bbox", "xmax") >= bbox[0],
+                    pads.field("bbox", "ymin") <= bbox[3], pads.field("bbox", "ymax") >= bbox[1]]
+    if datetime_range is not None:
+        start, end = utc_timestamp(datetime_range[0]), utc_timestamp(datetime_range[1])
+        in_range = (pads.field("datetime") >= start) & (pads.field("datetime") <= end)
+        if {"start_datetime", "end_datetime"} <= set(dataset.schema.names):
+            # items with a start and end instead of a single datetime overlap the range
+            in_range |= (pads.field("start_datetime") <= end) & (pads.field("end_datetime") >= start)
+        filters.append(in_range)
+    filters += [op(pads.field(name), value) for name, op, value in parse_query(query)]
+    
+    table = dataset.to_table(filter=combine_filters(filters))
+    return pystac.ItemCollection(
+        [pystac.Item.from_dict(item) for item in stac_geoparquet.arrow.stac_table_to_items(table)])
+
+def extract_metadata_geometry(bbox):
+    min_x = bbox[0]
+    min_y = bbox[1]
+    max_x = bbox[2]
+    max_y = bbox[3]
+    
+    geometry = {
+        "type": "Polygon",
+        "coordinates": [[
+            [min_x, min_y],
+            [max_x, min_y],
+            [max_x, max_y],
+            [min_x, max_y],
+            [min_x, min_y]
+        ]]
+    }
+    
+    return geometry
+
+def extract_metadata_time(temporal_extent):
+    start_time = datetime.strptime(temporal_extent[0], '%Y-%m-%d').isoformat() + "Z"
+    end_time = datetime.strptime(temporal_extent[1], '%Y-%m-%d').isoformat() + "Z"
+    
+    return start_time, end_time
+
+def extract_metadata_stac(bbox,
+                          temporal_extent,
+                          collection="sentinel-2-l2a",
+                          catalog_url=STAC_URL,
+                          cache_dir=STAC_CACHE_DIR,
+                          ttl=86400):
+    key = stac_cache_key("metadata", catalog_url, collection)
+    cached = read_stac_cache(key, cache_dir, ttl) if cache_dir else None
+    if cached is not None:
+        return cached["providers"], cached["links"]
+    
+    catalog = open_catalog(catalog_url)
+    if isinstance(catalog, pystac_client.Client):
+        stac_collection = catalog.get_collection(collection)
+    else:
+        stac_collection = catalog.get_child(collection)
+    providers = []
+    for p in stac_collection.providers:
+        providers.append(p.to_dict())
+    links = []
+    for link in catalog.get_links():
+        lnk = link.to_dict()
+        if collection in lnk["href"]:
+            lnk["rel"] = "derived_from"
+            lnk["title"] = "Derived from " + lnk["href"]
+            links.append(lnk)
+    
+    if cache_dir:
+        write_stac_cache(key, {"providers": providers, "links": links}, cache_dir)
+    return providers, links
@@ -0,0 +1,189 @@
+""" Filtering, indexing and storage of the daily in-situ snow station observations"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from .lazy import gpd
+from .filters import combine_filters
+
+
+def format_date(df):
+    from datetime import datetime 
+    if df.Date:
+        date_obj = datetime.strptime(df.Date, '%d.%m.%y')        
+        return date_obj.strftime('%Y-%m-%d')
+
+def parse_station_dates(dates, date_format='%d.%m.%y'):
+    # vectorised alternative to format_date for a whole Date column, returns a DatetimeIndex;
+    # dates not in date_format (e.g. ISO strings from format_date) fall back to format inference
+    try:
+        return pd.DatetimeIndex(pd.to_datetime(dates, format=date_format, cache=True))
+    except ValueError:
+        if date_format is None:
+            raise
+        return pd.DatetimeIndex(pd.to_datetime(dates, cache=True))
+
+def station_temporal_filter(station_daily_df,
+                    station_meta_df,
+                    start_date='2018-02-10',
+                    end_date='2018-06-30',
+                    date_format='%d.%m.%y'):
+    
+    # merge and filter to get lon/lat and start and end date
+    full_station_df = pd.merge(station_daily_df,
+                            station_meta_df,
+                            how="inner",
+                            on=["Provider", "Name"]
+                           ).set_index(station_daily_df.Date)
+    
+    full_station_df = full_station_df.drop(["HN_year_start", "HN_year_end", 
+                                            "HS_year_start", "HS_year_end"], axis=1)
+    # string dates (raw ones in date_format or ISO ones from format_date) are parsed once, then the rows
+    # are sorted and sliced by the parsed dates; the index itself is left as it was
+    dates = parse_station_dates(full_station_df.index, date_format)
+    order = dates.argsort(kind="stable")
+    order = order[~dates[order].isna()]
+    full_station_df, dates = full_station_df.iloc[order], dates[order]
+    full_station_df = full_station_df.iloc[dates.slice_indexer(start_date, end_date)]
+    
+    # convert lat/long to geometries
+    snow_stations = gpd.GeoDataFrame(
+        full_station_df,
+        geometry=gpd.points_from_xy(full_station_df.Longitude, full_station_df.Latitude),
+        crs="EPSG:4326"
+    )
+    return snow_stations
+
+def index_station_frame(full_station_df, date_format='%d.%m.%y', categorical=True):
+    # sorted DatetimeIndex, optional categorical station ids and point geometries for a station table;
+    # the Date column is moved into the index, date_format is the format of the raw station dates
+    dates = pd.to_datetime(full_station_df["Date"], format=date_format, cache=True)
+    full_station_df = full_station_df.drop(columns="Date").set_index(pd.DatetimeIndex(dates, name="Date"))
+    full_station_df = full_station_df.sort_index(ascending=True, kind="stable")
+    if categorical:
+        full_station_df["Provider"] = full_station_df["Provider"].astype("category")
+        full_station_df["Name"] = full_station_df["Name"].astype("category")
+    
+    snow_stations = gpd.GeoDataFrame(
+        full_station_df,
+        geometry=gpd.points_from_xy(full_station_df.Longitude, full_station_df.Latitude),
+        crs="EPSG:4326"
+    )
+    return snow_stations
+
+def prepare_station_store(station_daily_df, station_meta_df, date_format='%d.%m.%y', categorical=True):
+    # merges, sorts and geocodes the station tables once, slice the result with station_store_slice
+    full_station_df = pd.merge(station_daily_df,
+                            station_meta_df,
+                            how="inner",
+                            on=["Provider", "Name"]
+                           )
+    full_station_df = full_station_df.drop(["HN_year_start", "HN_year_end", 
+                                            "HS_year_start", "HS_year_end"], axis=1)
+    return index_station_frame(full_station_df, date_format, categorical)
+
+def station_store_slice(station_store, start_date='2018-02-10', end_date='2018-06-30', stations=None):
+    # date range by binary search on the sorted index, optionally restricted to some station names
+    snow_stations = station_store.iloc[station_store.index.slice_indexer(start_date, end_date)]
+    if stations is not None:
+        snow_stations = snow_stations[snow_stations["Name"].isin(stations)]
+    return snow_stations
+
+def save_station_store(station_store, path):
+    # writes the store as Parquet partitioned by provider and year, geometries are rebuilt on load
+    table = pd.DataFrame(station_store.drop(columns="geometry")).reset_index()
+    table["year"] = table["Date"].dt.year
+    table.to_parquet(path, partition_cols=["Provider", "year"], index=False)
+
+def load_station_store(path,
+                       start_date=None,
+                       end_date=None,
+                       columns=None,
+                       bbox=None,
+                       categorical=True):
+    # reads a store written by save_station_store, the date range, columns and
+    # (west, south, east, north) bbox are pushed down into the Parquet scan
+    import pyarrow.dataset as pads
+    
+    dataset = pads.dataset(path, format="parquet", partitioning="hive")
+    filters = []
+    if start_date is not None:
+        start = pd.Timestamp(start_date)
+        filters += [pads.field("year") >= start.year, pads.field("Date") >= start]
+    if end_date is not None:
+        end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        filters += [pads.field("year") <= end.year, pads.field("Date") < end]
+    if bbox is not None:
+        filters += [pads.field("Longitude") >= bbox[0], pads.field("Latitude") >= bbox[1],
+                    pads.field("Longitude") <= bbox[2], pads.field("Latitude") <= bbox[3]]
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, "Date", "Provider", "Name", "Longitude", "Latitude"]))
+    
+    full_station_df = dataset.to_table(columns=columns, filter=combine_filters(filters)).to_pandas()
+    full_station_df = full_station_df.drop(columns="year", errors="ignore")
+    return index_station_frame(full_station_df, date_format=None, categorical=categorical)
+
+def station_spatial_filter(snow_stations, catchment_area):
+    # select stations within catchment area, testing each station location once
+    # (bbox prefilter, then an STRtree backed sjoin) and broadcasting back to the daily rows
+    keys = ["Longitude", "Latitude"]
+    locations = snow_stations[keys + ["geometry"]].drop_duplicates(keys)
+    minx, miny, maxx, maxy = catchment_area.total_bounds
+    locations = locations.cx[minx:maxx, miny:maxy]
+    inside = gpd.sjoin(locations, catchment_area[["geometry"]], predicate='within')
+    
+    station_keys = pd.MultiIndex.from_frame(snow_stations[keys])
+    catchment_stations = snow_stations[station_keys.isin(pd.MultiIndex.from_frame(inside[keys]))]
+    
+    # remove unneccessary columns
+    station_columns = ['Provider', 'Name', 'HN', 'HS', 'HN_after_qc', 'HS_after_qc',
+       'HS_after_gapfill', 'Longitude', 'Latitude', 'Elevation', 'geometry']
+    catchment_stations = catchment_stations[station_columns]
+    return catchment_stations
+
+def binarize_snow(df):
+    # binarize snow presence at station level. 
+    '''
+    0:: implies no snow
+    1:: implies snow presence
+    '''
+    
+    if df["HS_after_gapfill"] > 0:
+        return 1
+    elif df["HS_after_gapfill"] <= 0:
+        return 0
+    else:
+        return 0
+
+def binarize_snow_column(df, nan_value=0):
+    # vectorised binarize_snow over the whole HS_after_gapfill column
+    '''
+    0:: implies no snow
+    1:: implies snow presence
+    nan_value:: assigned to missing snow depths, None keeps them as <NA>
+    '''
+    hs = df["HS_after_gapfill"].to_numpy(dtype="float64")
+    snow = (hs > 0).astype("int8")
+    if nan_value is None:
+        return pd.Series(snow, index=df.index, name="snow_presence", dtype="Int8").mask(np.isnan(hs))
+    snow[np.isnan(hs)] = nan_value
+    return pd.Series(snow, index=df.index, name="snow_presence")
+
+def benchmark_binarize_snow(df, number=3):
+    # compares the row-wise binarize_snow with binarize_snow_column, in seconds per call
+    row_wise = timeit.timeit(lambda: df.apply(binarize_snow, axis=1), number=number) / number
+    vectorised = timeit.timeit(lambda: binarize_snow_column(df), number=number) / number
+    return {"row_wise": row_wise, "vectorised": vectorised, "speedup": row_wise / vectorised}
+
+def assign_site_snow(df, snow_val):
+    # assign site snow values to the datacube output for validation
+    df["cube_snow"] = snow_val
+    df = df.set_index("id")
+    df = df.sort_values(axis=0, by="id")
+    df = df.dropna()
+    # assign 0 to cloudy pixels -- assumes no-snow
+    # df["cube_snow"] = np.where(df["cube_snow"] == np.nan, 0, np.where(df["cube_snow"]==1, 1, 0))
+    
+    return df
@@ -0,0 +1,14 @@
+import operator
+
+from snowcover.filters import combine_filters, parse_query
+
+
+def test_parse_query():
+    assert parse_query(["eo:cloud_cover<=90", "platform=sentinel-2b"]) == [
+        ("eo:cloud_cover", operator.le, 90.0), ("platform", operator.eq, "sentinel-2b")]
+    assert parse_query(None) == []
+
+
+def test_combine_filters():
+    assert combine_filters([]) is None
+    assert combine_filters([{1, 2, 3}, {2, 3}, {3, 4}]) == {3}
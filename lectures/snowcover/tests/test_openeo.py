@@ -0,0 +1,32 @@
+from unittest import mock
+
+from snowcover.backends.openeo import run_sca_jobs
+
+
+def mock_connection(statuses):
+    # openEO connection whose batch jobs go through the given status sequences, keyed by job title
+    def datacube_from_process(process_id, namespace, bbox, temporal_extent):
+        cube = mock.Mock()
+        def create_job(title, out_format):
+            job = mock.Mock(job_id="job-" + title)
+            job.status.side_effect = list(statuses[title])
+            return job
+        cube.create_job.side_effect = create_job
+        return cube
+    conn = mock.Mock()
+    conn.datacube_from_process.side_effect = datacube_from_process
+    return conn
+
+
+def test_run_sca_jobs_keeps_results_of_other_jobs(tmp_path):
+    conn = mock_connection({"senales": ["queued", "running", "finished"],
+                            "passeier": ["running", "error"]})
+    jobs = {"senales": ([10.7, 46.6, 10.9, 46.8], ["2018-02-01", "2018-06-30"]),
+            "passeier": ([11.1, 46.7, 11.3, 46.9], ["2018-02-01", "2018-06-30"])}
+    
+    results = run_sca_jobs(conn, jobs, str(tmp_path), poll_interval=0, max_poll_interval=0)
+    
+    assert results["senales"] == "job-senales"
+    assert isinstance(results["passeier"], RuntimeError)
+    assert "job-passeier" in str(results["passeier"])
+    assert conn.datacube_from_process.call_count == 2
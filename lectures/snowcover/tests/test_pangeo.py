@@ -0,0 +1,124 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+rasterio = pytest.importorskip("rasterio")
+pystac = pytest.importorskip("pystac")
+pytest.importorskip("stackstac")
+
+from rasterio.warp import transform, transform_bounds
+
+from snowcover.backends.pangeo import calculate_sca, calculate_sca_batch, sample_snow_at_stations, snow_kernel
+
+
+EPSG = 32632
+TRANSFORM = [10.0, 0.0, 600000.0, 0.0, -10.0, 5200000.0]
+# digital numbers with scale 0.0001 and offset -0.1 (processing baseline 04.00):
+# snow, no snow, snow only after removing the offset, cloud
+GREEN = np.array([[9000, 2000], [4000, 5000]], dtype="uint16")
+SWIR = np.array([[2000, 3000], [2000, 1500]], dtype="uint16")
+SCL = np.array([[4, 4], [4, 9]], dtype="uint16")
+
+
+def scaled_item(tmp_path):
+    assets = {}
+    for name, values in [("green", GREEN), ("swir16", SWIR), ("scl", SCL)]:
+        path = str(tmp_path / (name + ".tif"))
+        with rasterio.open(path, "w", driver="GTiff", width=2, height=2, count=1, dtype="uint16",
+                           crs="EPSG:{}".format(EPSG), transform=rasterio.Affine(*TRANSFORM), nodata=0) as dst:
+            dst.write(values, 1)
+        bands = {"nodata": 0, "data_type": "uint16"}
+        if name != "scl":
+            bands.update(scale=0.0001, offset=-0.1)
+        assets[name] = pystac.Asset(href=path,
+                                    media_type=pystac.MediaType.GEOTIFF,
+                                    extra_fields={"proj:epsg": EPSG,
+                                                  "proj:shape": [2, 2],
+                                                  "proj:transform": TRANSFORM,
+                                                  "raster:bands": [bands]})
+    bounds = transform_bounds("EPSG:{}".format(EPSG), "EPSG:4326",
+                              600000.0, 5199980.0, 600020.0, 5200000.0)
+    west, south, east, north = bounds
+    item = pystac.Item(id="S2_test",
+                       geometry={"type": "Polygon",
+                                 "coordinates": [[[west, south], [east, south], [east, north],
+                                                  [west, north], [west, south]]]},
+                       bbox=list(bounds),
+                       datetime=datetime.datetime(2018, 2, 10, 10, 0, tzinfo=datetime.timezone.utc),
+                       properties={"proj:epsg": EPSG},
+                       collection="sentinel-2-l2a")
+    for name, asset in assets.items():
+        item.add_asset(name, asset)
+    return item, bounds
+
+
+@pytest.mark.parametrize("dtype", ["float32", "uint16", "float64"])
+def test_calculate_sca_scales_items(tmp_path, dtype):
+    item, bounds = scaled_item(tmp_path)
+    snowmap = calculate_sca(bounds, ["2018-02-01", "2018-02-28"], dtype=dtype, resolution=10,
+                            epsg=EPSG, items=[item], cache_dir=None).compute(scheduler="synchronous")
+    
+    # stackstac labels each pixel by its top-left corner, the corners of the test pixels are exact labels
+    corners = {"x": [600000.0, 600010.0], "y": [5200000.0, 5199990.0]}
+    x = snowmap.indexes["x"].get_indexer(corners["x"], method="nearest")
+    y = snowmap.indexes["y"].get_indexer(corners["y"], method="nearest")
+    values = snowmap.isel(time=0, x=x, y=y).values
+    np.testing.assert_array_equal(values, [[1, 0], [1, np.nan]])
+
+
+def test_snow_kernel_fill_value_is_no_data():
+    green = np.array([0, 9000], dtype="uint16")
+    swir = np.array([2000, 2000], dtype="uint16")
+    scl = np.array([4, 4], dtype="uint16")
+    out = snow_kernel(green, swir, scl, 0.4, np.nan, "float32", 0.0001, -0.1, 0.0001, -0.1, fill_value=0)
+    np.testing.assert_array_equal(out, [np.nan, 1])
+
+
+def test_calculate_sca_batch_shared_reads_match_single_reads(tmp_path):
+    item, bounds = scaled_item(tmp_path)
+    catalog = pystac.Catalog(id="test", description="test catalog")
+    catalog.add_item(item)
+    catalog.normalize_and_save(str(tmp_path / "catalog"), pystac.CatalogType.SELF_CONTAINED)
+    jobs = [(bounds, ["2018-02-01", "2018-02-28"]), (bounds, ["2018-03-01", "2018-03-31"])]
+    options = {"catalog_url": str(tmp_path / "catalog" / "catalog.json"), "cache_dir": None, "query": None,
+               "resolution": 10, "scheduler": "synchronous"}
+    
+    shared = calculate_sca_batch(jobs, share_reads=True, **options)
+    single = calculate_sca_batch(jobs, share_reads=False, **options)
+    
+    assert shared[1] is None and single[1] is None
+    assert shared[0].shape == single[0].shape
+    np.testing.assert_array_equal(shared[0].values, single[0].values)
+
+
+def station_frame(x, y, dates):
+    longitude, latitude = transform("EPSG:{}".format(EPSG), "EPSG:4326", x, y)
+    return pd.DataFrame({"Longitude": longitude, "Latitude": latitude}, index=pd.Index(dates, name="Date"))
+
+
+def test_sample_snow_at_stations_picks_the_pixel_containing_the_station(tmp_path):
+    pytest.importorskip("geopandas")
+    item, bounds = scaled_item(tmp_path)
+    snowmap = calculate_sca(bounds, ["2018-02-01", "2018-02-28"], resolution=10,
+                            epsg=EPSG, items=[item], cache_dir=None).compute(scheduler="synchronous")
+    # snow pixel and cloud pixel, both closer to a neighbouring top-left corner than to their own
+    stations = station_frame([600008.0, 600018.0], [5199992.0, 5199982.0], ["10.02.18", "10.02.18"])
+    
+    sampled = sample_snow_at_stations(snowmap, stations)
+    
+    np.testing.assert_array_equal(sampled.cube_snow.to_numpy(), [1, np.nan])
+
+
+def test_sample_snow_at_stations_prefers_clear_acquisitions():
+    pytest.importorskip("geopandas")
+    xr = pytest.importorskip("xarray")
+    times = pd.to_datetime(["2018-02-10T10:00", "2018-02-10T10:30", "2018-02-15T10:00"])
+    snowmap = xr.DataArray(np.array([2, 0, 2], dtype="uint8").reshape(3, 1, 1), dims=["time", "y", "x"],
+                           coords={"time": times, "y": [5199995.0], "x": [600005.0], "epsg": EPSG})
+    stations = station_frame([600005.0, 600005.0], [5199995.0, 5199995.0], ["10.02.18", "15.02.18"])
+    
+    sampled = sample_snow_at_stations(snowmap, stations, cloud_value=2, xy_coords="center")
+    
+    np.testing.assert_array_equal(sampled.cube_snow.to_numpy(), [0, 2])
@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip("rasterio")
+
+from snowcover.raster import compute_raster_stats, write_cog
+
+
+def snow_map(path, dtype="float32", nodata=np.nan, missing=np.nan):
+    values = np.tile(np.array([0, 1, 2, missing], dtype="float64"), (600, 150)).astype(dtype)
+    with rasterio.open(path, "w", driver="GTiff", width=600, height=600, count=1, dtype=dtype,
+                       crs="EPSG:32632", transform=rasterio.Affine(10, 0, 600000, 0, -10, 5200000),
+                       nodata=nodata) as dst:
+        dst.write(values, 1)
+    return values
+
+
+def pam_band(aux_path, band=1):
+    # the sidecar is parsed directly: whether GDAL reads it back depends on GDAL_DISABLE_READDIR_ON_OPEN
+    band_el = ET.parse(aux_path).getroot().find("PAMRasterBand[@band='{}']".format(band))
+    metadata = {el.get("key"): float(el.text) for el in band_el.iter("MDI")}
+    nodata = band_el.find("NoDataValue")
+    return metadata, None if nodata is None else float(nodata.text)
+
+
+def engine_available(engine):
+    if engine == "gdal":
+        pytest.importorskip("osgeo.gdal")
+    return engine
+
+
+@pytest.mark.parametrize("engine", ["rasterio", "gdal"])
+def test_write_cog_keeps_clouds_and_marks_missing_pixels(tmp_path, engine):
+    snow_map(str(tmp_path / "snow.tif"))
+    errors = write_cog(str(tmp_path / "snow.tif"), str(tmp_path / "snow_cog.tif"), engine=engine_available(engine))
+    
+    assert errors == []
+    with rasterio.open(tmp_path / "snow_cog.tif") as src:
+        assert src.dtypes[0] == "uint8"
+        assert src.nodata == 255
+        # 600 rows are written in two windows of blocksize (512) rows
+        np.testing.assert_array_equal(src.read(1)[[0, 511, 512, 599], :4], [[0, 1, 2, 255]] * 4)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["snow.tif", "snow_cog.tif"]
+
+
+@pytest.mark.parametrize("engine", ["rasterio", "gdal"])
+def test_compute_raster_stats_writes_sidecar_only(tmp_path, engine):
+    snow_map(str(tmp_path / "snow.tif"))
+    write_cog(str(tmp_path / "snow.tif"), str(tmp_path / "snow_cog.tif"))
+    before = (tmp_path / "snow_cog.tif").read_bytes()
+    
+    stats = compute_raster_stats(str(tmp_path / "snow_cog.tif"), max_workers=4, engine=engine_available(engine))
+    
+    assert (tmp_path / "snow_cog.tif").read_bytes() == before
+    assert stats[0]["count"] == 600 * 450
+    np.testing.assert_array_equal(stats[0]["hist"][:3], [600 * 150] * 3)
+    metadata, nodata = pam_band(str(tmp_path / "snow_cog.tif.aux.xml"))
+    assert metadata["STATISTICS_MEAN"] == pytest.approx(1.0)
+    assert metadata["STATISTICS_MAXIMUM"] == 2
+    assert nodata == 255
+
+
+@pytest.mark.parametrize("engine", ["rasterio", "gdal"])
+def test_compute_raster_stats_leaves_out_the_given_nodata(tmp_path, engine):
+    snow_map(str(tmp_path / "snow.tif"), nodata=None, missing=-9999)
+    
+    stats = compute_raster_stats(str(tmp_path / "snow.tif"), nodata=-9999, engine=engine_available(engine))
+    
+    assert stats[0]["count"] == 600 * 450
+    metadata, nodata = pam_band(str(tmp_path / "snow.tif.aux.xml"))
+    assert metadata["STATISTICS_MINIMUM"] == 0
+    assert metadata["STATISTICS_MEAN"] == pytest.approx(1.0)
+    assert nodata == -9999
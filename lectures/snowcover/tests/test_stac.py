@@ -0,0 +1,174 @@
+import datetime
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from snowcover.stac import read_stac_cache, write_stac_cache
+
+
+def test_write_stac_cache_from_many_threads(tmp_path):
+    # repeated keys race on the same entry, the small size limit makes every write evict
+    def write(i):
+        write_stac_cache("key{}".format(i % 10), {"features": ["x" * 1000] * 20}, str(tmp_path), max_size_mb=0.1)
+    
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(write, range(400)))
+    
+    assert not list(tmp_path.glob("*.tmp"))
+    assert read_stac_cache("missing", str(tmp_path)) is None
+
+
+def stub_catalog(tmp_path):
+    pystac = pytest.importorskip("pystac")
+    collection = pystac.Collection(
+        id="sentinel-2-l2a",
+        description="stub",
+        extent=pystac.Extent(pystac.SpatialExtent([[10, 46, 12, 47]]),
+                             pystac.TemporalExtent([[None, None]])))
+    for day, west, cloud_cover in [(1, 10.0, 10), (5, 11.0, 95), (20, 11.0, 5)]:
+        bbox = [west, 46.0, west + 1, 47.0]
+        collection.add_item(pystac.Item(
+            id="S2_2018-02-{:02d}_{}".format(day, int(west)),
+            geometry={"type": "Polygon", "coordinates": [[[bbox[0], bbox[1]], [bbox[2], bbox[1]], [bbox[2], bbox[3]],
+                                                          [bbox[0], bbox[3]], [bbox[0], bbox[1]]]]},
+            bbox=bbox,
+            datetime=datetime.datetime(2018, 2, day, tzinfo=datetime.timezone.utc),
+            properties={"eo:cloud_cover": cloud_cover}))
+    catalog = pystac.Catalog(id="stub", description="stub catalog")
+    catalog.add_child(collection)
+    catalog.normalize_hrefs(str(tmp_path / "catalog"))
+    catalog.save(catalog_type=pystac.CatalogType.SELF_CONTAINED)
+    return str(tmp_path / "catalog" / "catalog.json")
+
+
+def test_search_items_concurrently_on_stub_catalog(tmp_path):
+    from snowcover.stac import search_items_concurrently
+    catalog_url = stub_catalog(tmp_path)
+    searches = [([11.2, 46.2, 11.4, 46.4], ["2018-02-01", "2018-02-10"]),
+                ([10.2, 46.2, 11.4, 46.4], ["2018-02-01", "2018-02-28"])]
+    
+    for _ in range(2):
+        # the second round is answered from the cache
+        results = search_items_concurrently(searches, query=["eo:cloud_cover<=90"],
+                                            catalog_url=catalog_url, cache_dir=str(tmp_path / "cache"))
+        assert [sorted(item.id for item in items) for items in results] == [
+            [], ["S2_2018-02-01_10", "S2_2018-02-20_11"]]
+    assert len(list((tmp_path / "cache").glob("*.json"))) == 2
+
+
+class StubStacApi(BaseHTTPRequestHandler):
+    # minimal STAC API: a landing page and an item search that fails with 503 the first `failures` times
+    failures = 2
+    
+    def send_json(self, status, document):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        url = "http://{}:{}".format(*self.server.server_address)
+        if self.path.rstrip("/") == "":
+            self.send_json(200, {
+                "type": "Catalog", "stac_version": "1.0.0", "id": "stub", "description": "stub api",
+                "conformsTo": ["https://api.stacspec.org/v1.0.0/core",
+                               "https://api.stacspec.org/v1.0.0/item-search"],
+                "links": [{"rel": "self", "href": url + "/", "type": "application/json"},
+                          {"rel": "root", "href": url + "/", "type": "application/json"},
+                          {"rel": "search", "href": url + "/search", "type": "application/geo+json",
+                           "method": "POST"}]})
+        else:
+            self.do_POST()
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.searches += 1
+        if self.server.searches <= self.failures:
+            self.send_json(503, {"code": "unavailable"})
+            return
+        bbox = [11.0, 46.0, 12.0, 47.0]
+        self.send_json(200, {"type": "FeatureCollection", "links": [], "features": [{
+            "type": "Feature", "stac_version": "1.0.0", "id": "S2_2018-02-20_11", "collection": "sentinel-2-l2a",
+            "geometry": {"type": "Polygon", "coordinates": [[[11, 46], [12, 46], [12, 47], [11, 47], [11, 46]]]},
+            "bbox": bbox, "properties": {"datetime": "2018-02-20T10:00:00Z", "eo:cloud_cover": 5},
+            "assets": {}, "links": []}]})
+    
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStacApi)
+    server.searches = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_search_items_retries_and_times_a_stub_api(stub_api):
+    pytest.importorskip("pystac_client")
+    from snowcover.stac import STAC_CLIENTS, open_catalog, pop_stac_timings, search_items
+    catalog_url = "http://{}:{}".format(*stub_api.server_address)
+    pop_stac_timings()
+    try:
+        items = search_items([11.2, 46.2, 11.4, 46.4], ["2018-02-01", "2018-02-28"],
+                             catalog_url=catalog_url, cache_dir=None)
+        
+        assert [item.id for item in items] == ["S2_2018-02-20_11"]
+        # two 503 answers were retried by the session before the search succeeded
+        assert stub_api.searches == StubStacApi.failures + 1
+        assert open_catalog(catalog_url) is STAC_CLIENTS[catalog_url]
+        timings = pop_stac_timings()
+        assert (timings.status == 200).all()
+        assert "POST" in set(timings.method)
+        assert (timings.seconds >= 0).all()
+        assert pop_stac_timings().empty
+    finally:
+        STAC_CLIENTS.pop(catalog_url, None)
+
+
+def test_query_stac_geoparquet_with_utc_range(tmp_path):
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("stac_geoparquet")
+    pystac = pytest.importorskip("pystac")
+    from snowcover.stac import export_stac_geoparquet, query_stac_geoparquet
+    items = list(pystac.Catalog.from_file(stub_catalog(tmp_path)).get_items(recursive=True))
+    
+    export_stac_geoparquet(items, str(tmp_path / "items.parquet"))
+    found = query_stac_geoparquet(str(tmp_path / "items.parquet"),
+                             bbox=[11.2, 46.2, 11.4, 46.4],
+                             datetime_range=["2018-02-02T00:00:00Z", "2018-02-28T00:00:00Z"],
+                             query=["eo:cloud_cover<=90"])
+    
+    assert [item.id for item in found] == ["S2_2018-02-20_11"]
+
+
+def test_build_stac_collection_is_self_contained(tmp_path):
+    pytest.importorskip("rio_stac")
+    rasterio = pytest.importorskip("rasterio")
+    import numpy as np
+    from snowcover.stac import build_stac_collection
+    # the tile is only in the directory name, the file names repeat across tiles
+    for tile, date in [("32TPS", "2018-02-10"), ("32TPT", "2018-02-10"), ("32TPS", "2018-02-15")]:
+        (tmp_path / "maps" / tile).mkdir(parents=True, exist_ok=True)
+        with rasterio.open(tmp_path / "maps" / tile / "snow_{}.tif".format(date), "w", driver="GTiff",
+                           width=4, height=4, count=1, dtype="uint8", crs="EPSG:32632",
+                           transform=rasterio.Affine(10, 0, 600000, 0, -10, 5200000)) as dst:
+            dst.write(np.ones((4, 4), dtype="uint8"), 1)
+    
+    collection = build_stac_collection(str(tmp_path / "maps"), str(tmp_path / "catalog"),
+                                       cache_dir=str(tmp_path / "cache"))
+    
+    assets = {name: asset.href for item in collection.get_items() for name, asset in item.assets.items()}
+    assert sorted(assets) == ["32TPS/snow_2018-02-10", "32TPS/snow_2018-02-15", "32TPT/snow_2018-02-10"]
+    assert all(not href.startswith("..") for href in assets.values())
+    assert len(list((tmp_path / "catalog").rglob("*.tif"))) == 3
+    assert list((tmp_path / "cache").glob("*.json"))
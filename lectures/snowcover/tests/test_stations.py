@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("geopandas")
+
+from snowcover.stations import prepare_station_store, station_store_slice, station_temporal_filter
+
+
+def station_tables():
+    daily = pd.DataFrame({"Provider": "AT_HZB", "Name": "Obergurgl",
+                          "Date": ["01.12.17", "12.01.18", "07.07.18"], "HS": [10.0, 55.0, 0.0]})
+    meta = pd.DataFrame({"Provider": ["AT_HZB"], "Name": ["Obergurgl"], "Longitude": [11.02],
+                         "Latitude": [46.87], "Elevation": [1938], "HN_year_start": [1950],
+                         "HN_year_end": [2020], "HS_year_start": [1950], "HS_year_end": [2020]})
+    return daily, meta
+
+
+def test_prepare_station_store_parses_day_first_dates():
+    store = prepare_station_store(*station_tables())
+    
+    assert list(store.index) == [pd.Timestamp("2017-12-01"), pd.Timestamp("2018-01-12"),
+                                 pd.Timestamp("2018-07-07")]
+    assert "Date" not in store.columns
+    assert list(station_store_slice(store, "2018-01-01", "2018-06-30").HS) == [55.0]
+
+
+def test_station_temporal_filter_on_raw_dates():
+    stations = station_temporal_filter(*station_tables(), start_date="2017-12-01", end_date="2018-06-30")
+    
+    assert list(stations.index) == ["01.12.17", "12.01.18"]
+    assert list(stations.HS) == [10.0, 55.0]
+
+
+def test_station_temporal_filter_on_iso_dates():
+    daily, meta = station_tables()
+    daily["Date"] = ["2017-12-01", "2018-01-12", "2018-07-07"]
+    stations = station_temporal_filter(daily, meta, start_date="2018-01-01", end_date="2018-06-30")
+    
+    assert list(stations.HS) == [55.0]
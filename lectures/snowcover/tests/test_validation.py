@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from snowcover.validation import bootstrap_validation_metrics, confusion_counts, grouped_validation_metrics
+
+
+def validation_frame():
+    return pd.DataFrame({"snow_presence": [1, 1, 0, 0, 1, 0],
+                         "cube_snow": [1, 0, 0, 0, 1, np.nan],
+                         "Elevation": [900, 1500, 2100, 2600, 3400, 1200]})
+
+
+def test_grouped_validation_metrics_skips_missing_group_keys():
+    df = validation_frame()
+    bands = pd.cut(df.Elevation, [1000, 2000, 3000])
+    
+    metrics = grouped_validation_metrics(df, bands)
+    
+    assert list(metrics.n) == [1, 2]
+    assert list(metrics.accuracy) == [0.0, 1.0]
+
+
+def test_confusion_counts_rejects_fractional_labels():
+    np.testing.assert_array_equal(confusion_counts([1, 0, 1], [1.0, 0.0, np.nan]), [[1, 0], [0, 1]])
+    with pytest.raises(ValueError):
+        confusion_counts([1, 0], [0.5, 0.0])
+
+
+@pytest.mark.parametrize("block", [None, "Name"])
+def test_bootstrap_validation_metrics_without_valid_pairs_is_nan(block):
+    df = pd.DataFrame({"snow_presence": [1, 0], "cube_snow": [np.nan, np.nan], "Name": ["a", "b"]})
+    
+    metrics = bootstrap_validation_metrics(df, n_resamples=10, block=block, seed=0)
+    
+    assert metrics.isna().all().all()
+    assert list(metrics.index) == ["accuracy", "cf_00", "cf_01", "cf_10", "cf_11"]
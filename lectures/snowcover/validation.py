@@ -0,0 +1,107 @@
+""" Confusion matrices, accuracy and bootstrap uncertainty of the snow maps validated
+against in-situ station observations"""
+
+import numpy as np
+import pandas as pd
+
+
+def class_labels(labels):
+    # class labels as float64 with NaN for missing values; fractional labels (e.g. the median of an
+    # aggregate_spatial over a mixed area) are rejected instead of being truncated to a class
+    labels = pd.Series(labels).to_numpy(dtype="float64", na_value=np.nan)
+    fractional = np.isfinite(labels) & (labels != np.floor(labels))
+    if fractional.any():
+        raise ValueError("Class labels must be integers, got {}".format(np.unique(labels[fractional])[:5]))
+    return labels
+
+def confusion_counts(truth, predicted, n_classes=2):
+    # confusion matrix of one chunk with a single bincount, labels outside 0..n_classes-1 (e.g. NaN) are skipped;
+    # counts of different chunks, dates or workers are merged by adding them
+    truth = class_labels(truth)
+    predicted = class_labels(predicted)
+    valid = (truth >= 0) & (truth < n_classes) & (predicted >= 0) & (predicted < n_classes)
+    codes = truth[valid].astype(np.int64) * n_classes + predicted[valid].astype(np.int64)
+    return np.bincount(codes, minlength=n_classes**2).reshape(n_classes, n_classes)
+
+def accumulate_confusion(chunks, n_classes=2):
+    # streams confusion_counts over frames with snow_presence and cube_snow columns, e.g.
+    # read_csv(..., chunksize=...), a groupby per date or catchment, or computed dask partitions
+    cf = np.zeros((n_classes, n_classes), dtype=np.int64)
+    for chunk in chunks:
+        df = chunk[1] if isinstance(chunk, tuple) else chunk
+        cf += confusion_counts(df.snow_presence, df.cube_snow, n_classes)
+    return cf
+
+def accuracy_from_counts(cf):
+    return np.trace(cf) / cf.sum() if cf.sum() else np.nan
+
+def validation_metrics(df, n_classes=2):
+    cf = confusion_counts(df.snow_presence, df.cube_snow, n_classes)
+    acc = accuracy_from_counts(cf)
+    
+    return acc, cf
+
+def grouped_validation_metrics(df, by, n_classes=2):
+    # confusion matrix, accuracy, snow precision/recall/f1 and kappa for every group of
+    # df.groupby(by) (e.g. "Name", df.index.month or an elevation band) in a single bincount
+    truth = class_labels(df.snow_presence)
+    predicted = class_labels(df.cube_snow)
+    groups = df.groupby(by, sort=True)
+    # rows with a missing group key (e.g. outside every elevation band) get -1 and are skipped
+    group_idx = groups.ngroup().fillna(-1).astype(int).to_numpy()
+    group_keys = groups.size().index
+    
+    valid = ((group_idx >= 0) & (truth >= 0) & (truth < n_classes)
+             & (predicted >= 0) & (predicted < n_classes))
+    codes = (group_idx[valid] * n_classes**2 + truth[valid].astype(np.int64) * n_classes
+             + predicted[valid].astype(np.int64))
+    cf = np.bincount(codes, minlength=len(group_keys) * n_classes**2)
+    cf = cf.reshape(len(group_keys), n_classes, n_classes)
+    
+    total = cf.sum(axis=(1, 2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acc = np.trace(cf, axis1=1, axis2=2) / total
+        expected = (cf.sum(axis=2) * cf.sum(axis=1)).sum(axis=1) / total**2
+        kappa = (acc - expected) / (1 - expected)
+        precision = cf[:, 1, 1] / cf[:, :, 1].sum(axis=1)
+        recall = cf[:, 1, 1] / cf[:, 1, :].sum(axis=1)
+        f1 = 2 * precision * recall / (precision + recall)
+    
+    metrics = pd.DataFrame({"n": total, "accuracy": acc, "precision": precision,
+                            "recall": recall, "f1": f1, "kappa": kappa}, index=group_keys)
+    for i in range(n_classes):
+        for j in range(n_classes):
+            metrics["cf_{}{}".format(i, j)] = cf[:, i, j]
+    return metrics
+
+def bootstrap_validation_metrics(df, n_resamples=10000, block=None, confidence=0.95, seed=None, n_classes=2):
+    # bootstrap confidence intervals of the accuracy and of every confusion matrix cell;
+    # block resamples whole groups of df.groupby(block) (e.g. "Name" or df.index) instead of rows
+    # without any valid label pair (e.g. an all cloud station) every estimate and interval is NaN
+    rng = np.random.default_rng(seed)
+    names = ["accuracy"] + ["cf_{}{}".format(i, j) for i in range(n_classes) for j in range(n_classes)]
+    if block is None:
+        # resampled rows only change how often each label pair occurs: a multinomial draw per resample
+        cf = confusion_counts(df.snow_presence, df.cube_snow, n_classes).ravel()
+        if not cf.sum():
+            return pd.DataFrame(np.nan, index=names, columns=["estimate", "lower", "upper"])
+        samples = rng.multinomial(cf.sum(), cf / cf.sum(), size=n_resamples)
+    else:
+        # resampled blocks enter with multinomial weights on their own confusion matrices
+        metrics = grouped_validation_metrics(df, block, n_classes)
+        cf = metrics[[c for c in metrics.columns if c.startswith("cf_")]].to_numpy()
+        if not cf.sum():
+            return pd.DataFrame(np.nan, index=names, columns=["estimate", "lower", "upper"])
+        n_blocks = len(cf)
+        weights = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=n_resamples)
+        samples = weights @ cf
+        cf = cf.sum(axis=0)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acc = samples[:, ::n_classes + 1].sum(axis=1) / samples.sum(axis=1)
+    alpha = (1 - confidence) / 2
+    values = np.column_stack([acc, samples])
+    lower, upper = np.nanquantile(values, [alpha, 1 - alpha], axis=0)
+    
+    estimate = np.concatenate([[cf[::n_classes + 1].sum() / cf.sum()], cf])
+    return pd.DataFrame({"estimate": estimate, "lower": lower, "upper": upper}, index=names)